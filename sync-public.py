@@ -1,29 +1,340 @@
 #!/usr/bin/env python3
-"""Copy the public portions of config files to this repo, using # PUBLIC BELOW as the marker."""
+"""
+Copy the public portions of config files to this repo, using # PUBLIC BELOW as the marker.
+
+The files are listed in sync-public.manifest. Destinations whose content
+already matches are left alone, and --check only reports the ones that
+drifted (exiting with 1 if any did). --watch keeps running and re-syncs
+each file shortly after it changes.
+"""
 
 import sys
+import os
+import glob
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import hashlib
+import argparse
 from pathlib import Path
+from itertools import takewhile
+from concurrent.futures import ThreadPoolExecutor
 
-DOTFILES = Path(__file__).parent
+DOTFILES = Path(__file__).resolve().parent
 HOME = Path.home()
 MARKER = "# PUBLIC BELOW"
+MANIFEST = DOTFILES / "sync-public.manifest"
+# Files are read and hashed in chunks of this size
+CHUNK_SIZE = 64 * 1024
+MAX_WORKERS = 8
+# In --watch mode, changes are synced once no more came for this long...
+WATCH_DEBOUNCE = 0.3
+# ...and without inotify (e.g. on macOS) sources are stat'ed this often.
+POLL_INTERVAL = 1.0
+# inotify(7) events that mean a file was written or moved into place, or a
+# directory was created (IN_CREATE with IN_ISDIR)
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def read_manifest(manifest):
+    """Returns the (source pattern, destination) pairs listed in the manifest."""
+    entries = []
+    with open(manifest, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split()
+            if len(parts) != 2:
+                raise ValueError(f"{manifest}:{number}: expected '<source> <destination>'")
+            entries.append((parts[0], parts[1]))
+    return entries
+
+
+def expand_manifest(entries):
+    """
+    Expands the manifest entries into (src, dst) paths. Returns (pairs,
+    errors), errors listing the patterns that matched no file.
+    """
+    pairs = []
+    errors = []
+    for pattern, destination in entries:
+        if not glob.has_magic(pattern):
+            pairs.append((HOME / pattern, DOTFILES / destination))
+            continue
+        base, = glob_bases([(pattern, destination)])
+        matches = sorted(p for p in HOME.glob(pattern) if p.is_file())
+        if not matches:
+            errors.append(f"no files match '{pattern}'")
+        for src in matches:
+            pairs.append((src, DOTFILES / destination / src.relative_to(base)))
+    return pairs, errors
+
+
+def public_lines(src):
+    """
+    Streams the lines of `src` from the marker on, newline-terminated.
+    Raises LookupError if the marker is missing.
+    """
+    with open(src, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip() == MARKER:
+                yield line.rstrip("\n") + "\n"
+                break
+        else:
+            raise LookupError(f"marker '{MARKER}' not found in {src}")
+        for line in f:
+            yield line.rstrip("\n") + "\n"
+
+
+def public_digest(src):
+    """Hash of the public section of `src`, as it would be written out."""
+    digest = hashlib.sha256()
+    for line in public_lines(src):
+        digest.update(line.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """Hash of the file at `path`, or None if it doesn't exist."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def write_public(src, dst):
+    """Streams the public section of `src` into `dst`, replacing it atomically."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as out:
+            out.writelines(public_lines(src))
+        os.replace(tmp, dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def sync_file(src, dst, check=False):
+    """
+    Syncs one file. Returns "unchanged", "wrote" or (with `check`) "drift".
+    Raises OSError or LookupError on problems with the source.
+    """
+    if public_digest(src) == file_digest(dst):
+        return "unchanged"
+    if check:
+        return "drift"
+    write_public(src, dst)
+    return "wrote"
+
+
+def sync_all(pairs, check=False):
+    """
+    Syncs all (src, dst) pairs concurrently, printing what happened to each
+    in order. Returns True if everything was in sync or synced cleanly.
+    """
+    def run(pair):
+        try:
+            return sync_file(*pair, check=check)
+        except (OSError, LookupError) as e:
+            return e
+
+    ok = True
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        for (src, dst), result in zip(pairs, pool.map(run, pairs)):
+            if isinstance(result, Exception):
+                print(f"ERROR: {result}", file=sys.stderr)
+                ok = False
+            elif result == "wrote":
+                print(f"Wrote {dst}")
+            elif result == "drift":
+                print(f"Out of date: {dst} (from {src})")
+                ok = False
+    return ok
+
 
-FILES = [
-    (HOME / ".config/jj/config.toml", DOTFILES / "jj/config.toml"),
-    (HOME / ".gitconfig",             DOTFILES / "git/.gitconfig"),
-]
+def glob_bases(entries):
+    """The directories globbed manifest entries match files under."""
+    return {
+        HOME.joinpath(*takewhile(lambda part: not glob.has_magic(part), Path(pattern).parts))
+        for pattern, _ in entries
+        if glob.has_magic(pattern)
+    }
 
-errors = False
-for src, dst in FILES:
-    lines = src.read_text().splitlines()
+
+def glob_dirs(entries):
+    """
+    The existing directories globbed manifest entries can match files in:
+    their bases, and whatever matches the directory part of the pattern
+    (every directory under the base, with **).
+    """
+    dirs = glob_bases(entries)
+    for pattern, _ in entries:
+        parent = Path(pattern).parent
+        if glob.has_magic(str(parent)):
+            dirs.update(p for p in HOME.glob(str(parent)) if p.is_dir())
+    return dirs
+
+
+def inotify_changes(watched_dirs):
+    """
+    Yields sets of paths changed in the directories `watched_dirs()`
+    returns, each set once no more events came for WATCH_DEBOUNCE. New
+    subdirectories count as changes too, so the caller can start watching
+    them. Directories (rather than files) are watched so editors that save
+    by renaming a new file into place are seen too. Returns None if inotify
+    isn't available.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
     try:
-        idx = next(i for i, l in enumerate(lines) if l.strip() == MARKER)
-    except StopIteration:
-        print(f"ERROR: marker '{MARKER}' not found in {src}", file=sys.stderr)
-        errors = True
-        continue
-    dst.write_text("\n".join(lines[idx:]) + "\n")
-    print(f"Wrote {dst}")
-
-if errors:
-    sys.exit(1)
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+
+    def changes():
+        dirs_by_wd = {}
+        while True:
+            # Adding a watch again is a no-op, so this picks up new directories
+            for directory in watched_dirs():
+                wd = libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+                if wd >= 0:
+                    dirs_by_wd[wd] = directory
+            changed = set()
+            timeout = None
+            while select.select([fd], [], [], timeout)[0]:
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                offset = 0
+                while offset < len(data):
+                    wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = data[offset:offset + length].rstrip(b"\0")
+                    offset += length
+                    if mask & IN_CREATE and not mask & IN_ISDIR:
+                        # New files are seen once written
+                        continue
+                    if wd in dirs_by_wd and name:
+                        changed.add(dirs_by_wd[wd] / os.fsdecode(name))
+                timeout = WATCH_DEBOUNCE
+            yield changed
+
+    return changes()
+
+
+def poll_changes(watched_files):
+    """
+    Fallback for inotify_changes: stats the files `watched_files()` returns
+    every POLL_INTERVAL, and yields the set of changed ones once they stop
+    changing for WATCH_DEBOUNCE.
+    """
+    def signature(path):
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    seen = {path: signature(path) for path in watched_files()}
+    while True:
+        time.sleep(POLL_INTERVAL)
+        changed = set()
+        interval = POLL_INTERVAL
+        while True:
+            current = {path: signature(path) for path in watched_files()}
+            new = {path for path, sig in current.items() if seen.get(path, sig) != sig}
+            seen = current
+            if not new:
+                break
+            changed |= new
+            time.sleep(WATCH_DEBOUNCE)
+        if changed:
+            yield changed
+
+
+def watch(manifest):
+    """
+    Syncs everything once, then keeps re-syncing just the files that change
+    until interrupted. A change to the manifest reloads it, and new files
+    under a glob base, including in new subdirectories, are picked up
+    (with inotify only).
+    """
+    def load():
+        try:
+            entries = read_manifest(manifest)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            return [], {}
+        pairs, errors = expand_manifest(entries)
+        for error in errors:
+            print(f"ERROR: {error}", file=sys.stderr)
+        return entries, dict(pairs)
+
+    entries, destinations = load()
+    bases, dirs = glob_bases(entries), glob_dirs(entries)
+    sync_all(list(destinations.items()))
+
+    changes = inotify_changes(lambda: {src.parent for src in destinations} | dirs | {manifest.parent})
+    if changes is None:
+        changes = poll_changes(lambda: set(destinations) | {manifest})
+    print(f"Watching {len(destinations)} files for changes")
+
+    for changed in changes:
+        if manifest in changed:
+            entries, destinations = load()
+            bases, dirs = glob_bases(entries), glob_dirs(entries)
+            sync_all(list(destinations.items()))
+            continue
+        if any(path.is_relative_to(base) for path in changed - destinations.keys() for base in bases):
+            # Maybe a new file (or directory) matching a glob. Files found
+            # in a new directory weren't watched yet, so sync them too.
+            expanded = dict(expand_manifest(entries)[0])
+            changed |= expanded.keys() - destinations.keys()
+            destinations.update(expanded)
+            dirs = glob_dirs(entries)
+        sync_all([(src, destinations[src]) for src in sorted(changed) if src in destinations])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="report drifted files without writing")
+    parser.add_argument("--watch", action="store_true", help="keep running, re-syncing files as they change")
+    parser.add_argument("--manifest", type=Path, default=MANIFEST, help="manifest to read (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.watch:
+        try:
+            watch(args.manifest.resolve())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    try:
+        pairs, errors = expand_manifest(read_manifest(args.manifest))
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    for error in errors:
+        print(f"ERROR: {error}", file=sys.stderr)
+
+    if not sync_all(pairs, args.check) or errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
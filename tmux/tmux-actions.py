@@ -1,26 +1,64 @@
 #!/usr/bin/env python3
+import time
+_IMPORT_START = time.perf_counter()
 import sys
+import os
+import json
+import signal
 import subprocess
 import re
+import hashlib
 from pathlib import Path
+# socket takes several milliseconds to import and only the server needs it,
+# so it (like threading, which subprocess loads anyway) is imported where used.
 
-def find_actions_file(start_path_str):
-    """
-    Finds the actions file.
-    1. Checks for .tmux-actions.md in the starting path.
-    2. Checks for .tmux-actions.md in the git repository root.
-    3. Falls back to tmux-actions.default.md in the script's directory.
-    Returns a Path object to the file or None if not found.
-    """
-    start_path = Path(start_path_str)
-    script_dir = Path(__file__).parent.resolve()
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from tmux_query import tmux_query
+import tmux_trace
+
+# --- Configuration ---
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "tmux-actions"
+NAME_CACHE_FILE = CACHE_DIR / "dynamic-names.json"
+ACTIONS_CACHE_FILE = CACHE_DIR / "parsed-actions.json"
+RESOLVE_CACHE_FILE = CACHE_DIR / "resolved-actions.json"
+# Per actions file and entry, how often and when it was last picked.
+USAGE_FILE = CACHE_DIR / "usage.json"
+GITHUB_CACHE_FILE = CACHE_DIR / "github-urls.json"
+# When each path was last prewarmed (see prewarm()).
+PREWARM_FILE = CACHE_DIR / "prewarm.json"
+DEFAULT_ACTIONS_FILE = Path(__file__).resolve().parent / "tmux-actions.default.md"
+# Unix socket the resident server (--serve) listens on.
+SOCKET_PATH = Path(os.environ.get("TMUX_ACTIONS_SOCKET", CACHE_DIR / "tmux-actions.sock"))
+# Seconds a memoized directory -> actions file resolution is trusted.
+RESOLVE_CACHE_TTL = 300
+# Seconds a cached dynamic name is considered fresh.
+NAME_CACHE_TTL = 60
+# Seconds after which a cached dynamic name that was never refreshed is dropped.
+MAX_NAME_CACHE_AGE = 7 * 24 * 3600
+# Seconds a single dynamic name command may run.
+DYNAMIC_NAME_TIMEOUT = 5
+# Seconds the menu waits for uncached dynamic names before showing it anyway.
+MENU_DEADLINE = 1.5
+# Seconds a cached GitHub URL is trusted.
+GITHUB_URL_TTL = 3600
+# Seconds before the same path can be prewarmed again, so quickly switching
+# back and forth between panes doesn't keep forking.
+PREWARM_INTERVAL = 15
+# Show the default actions below the repository ones.
+MERGE_DEFAULT_ACTIONS = True
+# Order the entries of each menu section by frecency (see frecency()).
+SORT_BY_FRECENCY = True
 
-    # 1. Check the current directory first.
-    local_file = start_path / ".tmux-actions.md"
-    if local_file.exists():
-        return local_file
+TITLE_RE = re.compile(r"^#\s+(?!#)(.+)", re.MULTILINE)
+H2_RE = re.compile(r"^##\s*(?:\[`(.+?)`\]\s*)?(.+?)$")
+BLOCKQUOTE_RE = re.compile(r">\s*`([^`]+)`\s*$")
 
-    # 2. If not found, try to find and check the git repository root.
+# In-process memos, mostly useful when running as a daemon (--serve).
+_RESOLVED_ACTIONS = {}  # directory -> resolved actions file
+_PARSED_ACTIONS = {}  # actions file -> parsed actions, with mtime and size
+
+def git_toplevel(start_path):
+    """Asks git for the repository root. Only used when walking the tree fails."""
     try:
         git_root_proc = subprocess.run(
             ["git", "rev-parse", "--show-toplevel"],
@@ -29,151 +67,553 @@ def find_actions_file(start_path_str):
             text=True,
             check=True
         )
-        git_root = Path(git_root_proc.stdout.strip())
-        root_file = git_root / ".tmux-actions.md"
-        if root_file.exists():
-            return root_file
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass
+        return Path(git_root_proc.stdout.strip())
+    except (subprocess.CalledProcessError, FileNotFoundError, NotADirectoryError):
+        return None
+
+def walk_for_actions_file(start_path):
+    """
+    Walks up from start_path looking for .tmux-actions.md, stopping at the
+    repository root (any directory with a .git directory or file, so
+    worktrees and submodules count). Returns (actions_file, found_repo).
+    """
+    for directory in (start_path, *start_path.parents):
+        candidate = directory / ".tmux-actions.md"
+        if candidate.is_file():
+            return candidate, True
+        if (directory / ".git").exists():
+            return None, True
+    return None, False
+
+def find_actions_file(start_path_str):
+    """
+    Finds the actions file.
+    1. Checks for .tmux-actions.md in the starting path and its parents,
+       up to the git repository root.
+    2. If no repository marker was found on the way up, asks git for the
+       root as a fallback (e.g. when GIT_DIR is set).
+    3. Falls back to tmux-actions.default.md in the script's directory.
+    Resolutions are memoized per directory, in process and on disk.
+    Returns a Path object to the file or None if not found.
+    """
+    start_path = Path(start_path_str)
+    memo_key = str(start_path)
+
+    # Memoized result, as long as it is recent and still there.
+    if not _RESOLVED_ACTIONS:
+        _RESOLVED_ACTIONS.update(read_json(RESOLVE_CACHE_FILE))
+    cached = _RESOLVED_ACTIONS.get(memo_key)
+    if cached and time.time() - cached["time"] < RESOLVE_CACHE_TTL:
+        cached_file = Path(cached["file"]) if cached["file"] else None
+        local_file = start_path / ".tmux-actions.md"
+        if cached_file == local_file or not local_file.exists():
+            if cached_file is None or cached_file.exists():
+                return cached_file
+
+    # 1. Walk up to the repository root.
+    actions_file, found_repo = walk_for_actions_file(start_path)
+
+    # 2. Only fork git if the walk could not tell where the repository is.
+    if actions_file is None and not found_repo:
+        git_root = git_toplevel(start_path)
+        if git_root is not None:
+            root_file = git_root / ".tmux-actions.md"
+            if root_file.exists():
+                actions_file = root_file
 
     # 3. Fallback to the default file in the script's directory.
-    default_file = script_dir / "tmux-actions.default.md"
-    if default_file.exists():
-        return default_file
+    if actions_file is None and DEFAULT_ACTIONS_FILE.exists():
+        actions_file = DEFAULT_ACTIONS_FILE
 
-    return None
+    now = time.time()
+    for key in [k for k, v in _RESOLVED_ACTIONS.items() if now - v["time"] >= RESOLVE_CACHE_TTL]:
+        del _RESOLVED_ACTIONS[key]
+    _RESOLVED_ACTIONS[memo_key] = {
+        "file": str(actions_file) if actions_file else None,
+        "time": now,
+    }
+    write_json(RESOLVE_CACHE_FILE, _RESOLVED_ACTIONS)
+    return actions_file
 
 def display_tmux_message(message):
     """Shows a message in the tmux status line."""
     subprocess.run(["tmux", "display-message", message])
 
+def github_url(repo_path):
+    """
+    Turns the origin remote of the repository at repo_path into its GitHub
+    page URL, or "" if it can't be parsed. Raises CalledProcessError or
+    FileNotFoundError if there is no repository or origin remote.
+    """
+    git_url_proc = subprocess.run(
+        ["git", "-C", str(repo_path), "config", "--get", "remote.origin.url"],
+        capture_output=True, text=True, check=True
+    )
+    remote_url = git_url_proc.stdout.strip()
+    parsed_url = re.sub(r'.*github\.com[:/]', '', remote_url)
+    parsed_url = re.sub(r'\.git$', '', parsed_url)
+    return f"https://github.com/{parsed_url}" if parsed_url else ""
+
+def refresh_github_url(repo_path):
+    """
+    Looks up the GitHub URL for repo_path and caches it. Returns it, ""
+    if the remote can't be parsed or None if there's no repository.
+    """
+    try:
+        url = github_url(repo_path)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        url = None
+    now = time.time()
+    cache = read_json(GITHUB_CACHE_FILE)
+    for key in [k for k, v in cache.items() if now - v["time"] >= GITHUB_URL_TTL]:
+        del cache[key]
+    cache[str(repo_path)] = {"url": url, "time": now}
+    write_json(GITHUB_CACHE_FILE, cache)
+    return url
+
+def cached_github_url(repo_path):
+    """The cached lookup for repo_path, if recent, as {"url", "time"}."""
+    cached = read_json(GITHUB_CACHE_FILE).get(str(repo_path))
+    if cached and time.time() - cached["time"] < GITHUB_URL_TTL:
+        return cached
+    return None
+
 def open_github_repo(repo_path_str):
     """
     Checks if a path is a git repo, gets the remote origin URL,
-    parses it, and opens the GitHub page.
+    parses it, and opens the GitHub page. Uses the URL prewarm() left in
+    the cache when there is one.
     """
     repo_path = Path(repo_path_str)
+    cached = cached_github_url(repo_path)
+    if cached and cached["url"]:
+        final_url = cached["url"]
+    else:
+        # Without a cached URL (or with a failed lookup) ask git again.
+        with tmux_trace.phase("git"):
+            final_url = refresh_github_url(repo_path)
+        if final_url is None:
+            display_tmux_message("Not a git repository or no remote origin found.")
+            return
+        if not final_url:
+            display_tmux_message("Could not parse GitHub URL.")
+            return
+    come_back = "&& osascript -e 'tell application \"iTerm\" to activate'"
+    with tmux_trace.phase("action"):
+        subprocess.run(f"open {final_url} {come_back} || true", shell=True)
+
+def read_json(path):
+    """Loads a JSON cache file, or an empty dict if missing or corrupt."""
     try:
-        git_url_proc = subprocess.run(
-            ["git", "-C", str(repo_path), "config", "--get", "remote.origin.url"],
-            capture_output=True, text=True, check=True
-        )
-        remote_url = git_url_proc.stdout.strip()
-        parsed_url = re.sub(r'.*github\.com[:/]', '', remote_url)
-        parsed_url = re.sub(r'\.git$', '', parsed_url)
-        if parsed_url:
-            final_url = f"https://github.com/{parsed_url}"
-            come_back = "&& osascript -e 'tell application \"iTerm\" to activate'"
-            subprocess.run(f"open {final_url} {come_back} || true", shell=True)
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+def write_json(path, data):
+    """Atomically writes a JSON cache file. Failures are ignored."""
+    import threading
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_file.write_text(json.dumps(data))
+        os.replace(tmp_file, path)
+    except OSError:
+        pass
+
+def run_dynamic_names(commands, cwd, deadline):
+    """
+    Runs all dynamic name commands concurrently, each in its own shell.
+    Returns a dict of command -> name for those that finished within
+    `deadline` seconds. Anything still running after that is killed.
+    """
+    procs = {}
+    for command in commands:
+        try:
+            procs[command] = subprocess.Popen(
+                command,
+                shell=True,
+                cwd=cwd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                start_new_session=True
+            )
+        except OSError as e:
+            procs[command] = e
+
+    start = time.monotonic()
+    names = {}
+    for command, proc in procs.items():
+        if isinstance(proc, OSError):
+            names[command] = f"ERR: {proc}"
+            continue
+        remaining = deadline - (time.monotonic() - start)
+        try:
+            stdout, stderr = proc.communicate(timeout=max(remaining, 0.01))
+        except subprocess.TimeoutExpired:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            proc.communicate()
+            continue
+        if proc.returncode == 0:
+            names[command] = stdout.strip()
         else:
-            display_tmux_message("Could not parse GitHub URL.")
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        display_tmux_message("Not a git repository or no remote origin found.")
+            error_message = stderr.strip() or f"exit status {proc.returncode}"
+            names[command] = f"ERR: {error_message}"
+    return names
+
+def refresh_dynamic_names(current_path, commands, deadline=DYNAMIC_NAME_TIMEOUT):
+    """
+    Evaluates the given dynamic name commands in `current_path` and stores
+    the results in the cache, dropping names older than MAX_NAME_CACHE_AGE
+    (directories not visited since, commands no longer in a menu). Returns
+    the names that were computed.
+    """
+    names = run_dynamic_names(commands, current_path, deadline)
+    if deadline >= DYNAMIC_NAME_TIMEOUT:
+        for command in commands:
+            names.setdefault(command, f"ERR: timed out after {DYNAMIC_NAME_TIMEOUT} seconds")
+
+    now = time.time()
+    cache = {}
+    for directory, dir_cache in read_json(NAME_CACHE_FILE).items():
+        dir_cache = {c: v for c, v in dir_cache.items() if now - v["time"] < MAX_NAME_CACHE_AGE}
+        if dir_cache:
+            cache[directory] = dir_cache
+    dir_cache = cache.setdefault(str(current_path), {})
+    for command, name in names.items():
+        dir_cache[command] = {"name": name, "time": now}
+    write_json(NAME_CACHE_FILE, cache)
+    return names
+
+def refresh_in_background(current_path, commands):
+    """Spawns a detached copy of this script to refresh dynamic names."""
+    script_path = Path(__file__).resolve()
+    subprocess.Popen(
+        [sys.executable, str(script_path), "--refresh-names", str(current_path)] + list(commands),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+def resolve_dynamic_names(current_path, commands):
+    """
+    Returns a dict of command -> name for the dynamic menu entries.
+    Cached names are used as-is (stale ones are refreshed in the background),
+    uncached ones are evaluated concurrently up to MENU_DEADLINE.
+    """
+    if not commands:
+        return {}
+
+    dir_cache = read_json(NAME_CACHE_FILE).get(str(current_path), {})
+    now = time.time()
+    names = {}
+    missing = []
+    stale = []
+    for command in commands:
+        cached = dir_cache.get(command)
+        if cached is None:
+            missing.append(command)
+            continue
+        names[command] = cached["name"]
+        if now - cached["time"] > NAME_CACHE_TTL:
+            stale.append(command)
+
+    if missing:
+        computed = refresh_dynamic_names(current_path, missing, MENU_DEADLINE)
+        names.update(computed)
+        stale.extend(c for c in missing if c not in computed)
+
+    if stale:
+        refresh_in_background(current_path, stale)
+    return names
+
+def prewarm(current_path_str, wait=True):
+    """
+    Precomputes what opening the menu or the github action in a path will
+    need, for tmux hooks to call when a pane gets focus: the dynamic names
+    that are missing or stale, and the GitHub URL. Each path is done at
+    most once per PREWARM_INTERVAL, and nothing is run when the caches are
+    fresh. With wait=False (the daemon) the slow part runs in a thread.
+    """
+    current_path = Path(current_path_str)
+    now = time.time()
+    prewarmed = read_json(PREWARM_FILE)
+    if now - prewarmed.get(str(current_path), 0) < PREWARM_INTERVAL:
+        return
+    for key in [k for k, v in prewarmed.items() if now - v >= PREWARM_INTERVAL]:
+        del prewarmed[key]
+    prewarmed[str(current_path)] = now
+    write_json(PREWARM_FILE, prewarmed)
+
+    stale = []
+    actions_file = find_actions_file(current_path_str)
+    if actions_file:
+        _, sources = menu_sources(actions_file)
+        commands = [e["command"] for _, entries in sources for e in entries if e and e["dynamic"]]
+        dir_cache = read_json(NAME_CACHE_FILE).get(str(current_path), {})
+        stale = [
+            command for command in commands
+            if command not in dir_cache or now - dir_cache[command]["time"] > NAME_CACHE_TTL
+        ]
+    needs_url = cached_github_url(current_path) is None
+    if not stale and not needs_url:
+        return
+
+    def work():
+        if stale:
+            refresh_dynamic_names(current_path, stale)
+        if needs_url:
+            refresh_github_url(current_path)
+
+    if wait:
+        work()
+    else:
+        import threading
+        threading.Thread(target=work, daemon=True).start()
 
-def show_menu(current_path_str):
+def parse_actions(content):
+    """
+    Parses the contents of an actions file into a plain structure:
+    {"title": str or None, "entries": [...]}, where each entry is a dict
+    describing one menu item, or None for a separator.
+    """
+    title_match = TITLE_RE.search(content)
+    title = title_match.group(1).strip() if title_match else None
+
+    entries = []
+
+    lines = content.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+
+        # ADDED: Check for a separator line
+        if line.strip() == '---':
+            entries.append(None)
+            i += 1
+            continue
+
+        h2_match = H2_RE.match(line)
+        if not h2_match:
+            i += 1
+            continue
+
+        groups = h2_match.groups()
+        key_raw = groups[0].strip() if groups[0] else ""
+        name_placeholder = groups[1].strip()
+
+        send_keys_mode = key_raw.startswith('!')
+        visible_output_mode = key_raw.startswith('.')
+        key = key_raw
+        if send_keys_mode or visible_output_mode:
+            key = key_raw[1:]
+
+        is_dynamic_name = name_placeholder.startswith('`') and name_placeholder.endswith('`')
+        
+        command = None
+        press_enter = None
+
+        next_line_idx = i + 1
+        while next_line_idx < len(lines) and not lines[next_line_idx].strip():
+            next_line_idx += 1
+
+        if next_line_idx < len(lines):
+            command_line = lines[next_line_idx]
+            stripped_command_line = command_line.strip()
+
+            blockquote_match = BLOCKQUOTE_RE.match(stripped_command_line)
+
+            if blockquote_match:
+                press_enter = False
+                command = blockquote_match.group(1)
+                i = next_line_idx
+            elif stripped_command_line.startswith("```"):
+                press_enter = True
+                if "github" in stripped_command_line:
+                    command = "github"
+                else:
+                    command_lines = []
+                    i = next_line_idx + 1
+                    while i < len(lines) and lines[i].strip() != "```":
+                        command_lines.append(lines[i])
+                        i += 1
+                    command = "\n".join(command_lines).strip()
+
+        if command is None and 'github' in name_placeholder.lower():
+            command = 'github'
+
+        if not command:
+            i += 1
+            continue
+
+        entries.append({
+            "key": key,
+            "name": name_placeholder,
+            "command": command,
+            "press_enter": press_enter,
+            "send_keys": send_keys_mode,
+            "visible_output": visible_output_mode,
+            "dynamic": is_dynamic_name and command != "github",
+        })
+        i += 1
+
+    return {"title": title, "entries": entries}
+
+def load_actions(actions_file):
+    """
+    Returns the parsed actions for a file, reusing the on-disk cache when the
+    file's path, mtime and size are unchanged. Files that no longer exist
+    are dropped from the cache whenever it is written.
+    """
+    stat = actions_file.stat()
+    cache_key = str(actions_file.resolve())
+    cached = _PARSED_ACTIONS.get(cache_key)
+    if cached and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+        return cached["actions"]
+
+    cache = read_json(ACTIONS_CACHE_FILE)
+    cached = cache.get(cache_key)
+    if cached and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+        _PARSED_ACTIONS[cache_key] = cached
+        return cached["actions"]
+
+    actions = parse_actions(actions_file.read_text())
+    cache = {key: value for key, value in cache.items() if os.path.exists(key)}
+    cache[cache_key] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "actions": actions}
+    _PARSED_ACTIONS[cache_key] = cache[cache_key]
+    write_json(ACTIONS_CACHE_FILE, cache)
+    return actions
+
+def entry_id(entry):
+    """A short stable id for an entry, used as its key in the usage file."""
+    return hashlib.sha1(entry["command"].encode("utf-8")).hexdigest()[:12]
+
+def record_usage(file_key, entry_key):
+    """
+    Counts one use of an entry, stamped with the current time. Files that
+    no longer exist are dropped from the usage file at the same time.
+    """
+    usage = read_json(USAGE_FILE)
+    for stale in [k for k in usage if k != file_key and not Path(k).exists()]:
+        del usage[stale]
+    count, _ = usage.setdefault(file_key, {}).get(entry_key, [0, 0])
+    usage[file_key][entry_key] = [count + 1, time.time()]
+    write_json(USAGE_FILE, usage)
+
+def frecency(stats, now):
+    """
+    Scores [count, last_used] so that frequent and recent uses both count:
+    the count is weighted by how long ago the last use was.
+    """
+    if not stats:
+        return 0
+    count, last_used = stats
+    age = now - last_used
+    if age < 3600:
+        weight = 4
+    elif age < 86400:
+        weight = 2
+    elif age < 7 * 86400:
+        weight = 1
+    else:
+        weight = 0.5
+    return count * weight
+
+def menu_sources(actions_file):
+    """
+    Returns the parsed actions for `actions_file` and the [(file_key,
+    entries), ...] the menu is built from: the file's own entries, then
+    the default ones with MERGE_DEFAULT_ACTIONS.
+    """
+    actions = load_actions(actions_file)
+    sources = [(str(actions_file.resolve()), actions["entries"])]
+    if MERGE_DEFAULT_ACTIONS and actions_file.resolve() != DEFAULT_ACTIONS_FILE and DEFAULT_ACTIONS_FILE.exists():
+        sources.append((str(DEFAULT_ACTIONS_FILE), load_actions(DEFAULT_ACTIONS_FILE)["entries"]))
+    return actions, sources
+
+def merge_entries(sources, usage):
+    """
+    Builds the menu entries from [(file_key, entries), ...], the first file
+    taking precedence: later files are added after a separator, without
+    the commands the menu already has, and without the keys it already
+    uses. With SORT_BY_FRECENCY, entries within each separator-delimited
+    section are ordered by frecency, unused ones keeping file order.
+    Returns a list of (file_key, entry) and None for separators.
+    """
+    now = time.time()
+    seen_commands = set()
+    seen_keys = set()
+    merged = []
+    for position, (file_key, entries) in enumerate(sources):
+        sections = [[]]
+        for entry in entries:
+            if entry is None:
+                sections.append([])
+            elif position == 0:
+                sections[-1].append(entry)
+            elif entry["command"] not in seen_commands:
+                if entry["key"] in seen_keys:
+                    entry = dict(entry, key="")
+                sections[-1].append(entry)
+
+        file_usage = usage.get(file_key, {})
+        for section in filter(None, sections):
+            seen_commands.update(entry["command"] for entry in section)
+            seen_keys.update(entry["key"] for entry in section)
+            if SORT_BY_FRECENCY:
+                section.sort(key=lambda entry: -frecency(file_usage.get(entry_id(entry)), now))
+            if merged:
+                merged.append(None)
+            merged.extend((file_key, entry) for entry in section)
+    return merged
+
+def show_menu(current_path_str, client=None):
     """
     Finds or builds a list of actions and displays them in a tmux menu.
+    When `client` is given the menu is shown on that tmux client, which is
+    needed when running detached from it (as the daemon does).
     """
     script_path = Path(__file__).resolve()
     current_path = Path(current_path_str)
     
-    actions_file = find_actions_file(current_path_str)
+    with tmux_trace.phase("resolve"):
+        actions_file = find_actions_file(current_path_str)
 
     menu_items = []
     title = "#[align=centre]Actions…"
 
     if actions_file:
-        content = actions_file.read_text()
-        title_match = re.search(r"^#\s+(?!#)(.+)", content, re.MULTILINE)
-        if title_match:
-            title = f"#[align=centre]{title_match.group(1).strip()}"
+        with tmux_trace.phase("parse"):
+            actions, sources = menu_sources(actions_file)
+        with tmux_trace.phase("rank"):
+            entries = merge_entries(sources, read_json(USAGE_FILE))
+        if actions["title"]:
+            title = f"#[align=centre]{actions['title']}"
         else:
             title = f"#[align=centre]{actions_file.parent.name} Actions…"
 
-        lines = content.splitlines()
-        i = 0
-        while i < len(lines):
-            line = lines[i]
+        dynamic_commands = [e["command"] for _, e in filter(None, entries) if e["dynamic"]]
+        with tmux_trace.phase("dynamic_names"):
+            dynamic_names = resolve_dynamic_names(current_path, dynamic_commands)
 
-            # ADDED: Check for a separator line
-            if line.strip() == '---':
+        for item in entries:
+            if item is None:
                 menu_items.append("")
-                i += 1
                 continue
 
-            h2_match = re.match(r"^##\s*(?:\[`(.+?)`\]\s*)?(.+?)$", line)
-            if not h2_match:
-                i += 1
-                continue
+            file_key, entry = item
+            command = entry["command"]
+            final_name = entry["name"]
+            if entry["dynamic"]:
+                final_name = dynamic_names.get(command, "…")
 
-            groups = h2_match.groups()
-            key_raw = groups[0].strip() if groups[0] else ""
-            name_placeholder = groups[1].strip()
-
-            send_keys_mode = key_raw.startswith('!')
-            visible_output_mode = key_raw.startswith('.')
-            key = key_raw
-            if send_keys_mode or visible_output_mode:
-                key = key_raw[1:]
-
-            is_dynamic_name = name_placeholder.startswith('`') and name_placeholder.endswith('`')
-            
-            command = None
-            press_enter = None
-
-            next_line_idx = i + 1
-            while next_line_idx < len(lines) and not lines[next_line_idx].strip():
-                next_line_idx += 1
-
-            if next_line_idx < len(lines):
-                command_line = lines[next_line_idx]
-                stripped_command_line = command_line.strip()
-
-                blockquote_match = re.match(r">\s*`([^`]+)`\s*$", stripped_command_line)
-
-                if blockquote_match:
-                    press_enter = False
-                    command = blockquote_match.group(1)
-                    i = next_line_idx
-                elif stripped_command_line.startswith("```"):
-                    press_enter = True
-                    if "github" in stripped_command_line:
-                        command = "github"
-                    else:
-                        command_lines = []
-                        i = next_line_idx + 1
-                        while i < len(lines) and lines[i].strip() != "```":
-                            command_lines.append(lines[i])
-                            i += 1
-                        command = "\n".join(command_lines).strip()
-
-            if command is None and 'github' in name_placeholder.lower():
-                command = 'github'
-
-            if not command:
-                i += 1
-                continue
-
-            final_name = name_placeholder
-            if is_dynamic_name and command != "github":
-                try:
-                    proc = subprocess.run(
-                        command,
-                        shell=True,
-                        cwd=current_path,
-                        capture_output=True,
-                        text=True,
-                        check=True,
-                        timeout=5
-                    )
-                    final_name = proc.stdout.strip()
-                except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
-                    error_message = e.stderr.strip() if hasattr(e, 'stderr') and e.stderr else str(e)
-                    final_name = f"ERR: {error_message}"
-            
-            if send_keys_mode:
+            if entry["send_keys"]:
                 final_name = f"! {final_name}"
-            elif visible_output_mode:
+            elif entry["visible_output"]:
                 final_name = f". {final_name}"
 
             tmux_cmd = ""
@@ -183,11 +623,11 @@ def show_menu(current_path_str):
             else:
                 cmd_str = command.replace("'", "'\\''")
                 full_command = f'cd "{current_path}" && {cmd_str}'
-                if press_enter:
-                    if send_keys_mode:
+                if entry["press_enter"]:
+                    if entry["send_keys"]:
                         # Send keys to the current pane for execution.
                         tmux_cmd = f"send-keys -t . '{full_command}' C-m"
-                    elif visible_output_mode:
+                    elif entry["visible_output"]:
                         # Execute in background, show output.
                         tmux_cmd = f"run-shell -b '{full_command}'"
                     else:
@@ -197,29 +637,166 @@ def show_menu(current_path_str):
                     # Just type the command in the current pane without executing.
                     tmux_cmd = f"send-keys -t . '{full_command}'"
 
-            menu_items.extend([f"{final_name}", key, tmux_cmd])
-            i += 1
+            # Count the use in the background once the command is picked,
+            # through the server when it is up.
+            entry_key = entry_id(entry)
+            record_cmd = (
+                f"echo record {entry_key} '{file_key}' | nc -U '#{{@tmux-actions-socket}}' 2>/dev/null | grep -q '^ok'"
+                f" || '{script_path}' --record '{file_key}' {entry_key}"
+            )
+            tmux_cmd = f"{tmux_cmd} ; run-shell -b \"{record_cmd}\""
+
+            menu_items.extend([f"{final_name}", entry["key"], tmux_cmd])
     else:
         display_tmux_message("No actions file found.")
 
     if menu_items:
         menu_items.append("")
     menu_items.extend(["Exit", "q", ""])
-    subprocess.run(["tmux", "display-menu", "-T", title, "-x", "C", "-y", "C"] + menu_items)
+    target = ["-c", client] if client else []
+    with tmux_trace.phase("tmux"):
+        subprocess.run(["tmux", "display-menu"] + target + ["-T", title, "-x", "C", "-y", "C"] + menu_items)
+
+def handle_request(line):
+    """
+    Runs one daemon request, a single line of the form
+    `<menu|github|prewarm> <client> <path>`, or `record <entry_id>
+    <file_key>` to count a menu pick. Returns the reply line.
+    """
+    parts = line.strip().split(" ", 2)
+    if len(parts) != 3:
+        return "error: expected '<menu|github|prewarm|record> <client|entry_id> <path>'"
+    command, client, path = parts
+    tmux_trace.start(f"tmux-actions serve {command}")
+    try:
+        if command == "menu":
+            show_menu(path, client)
+        elif command == "github":
+            open_github_repo(path)
+        elif command == "prewarm":
+            prewarm(path, wait=False)
+        elif command == "record":
+            record_usage(path, client)
+        else:
+            return f"error: unknown command '{command}'"
+    finally:
+        tmux_trace.finish(f"tmux-actions serve {command}")
+    return "ok"
+
+def serve_connection(conn):
+    """
+    Reads one request line from a daemon connection, answers it and closes
+    the connection.
+    """
+    try:
+        with conn, conn.makefile("rwb") as stream:
+            line = stream.readline().decode("utf-8")
+            if not line:
+                return
+            try:
+                reply = handle_request(line)
+            except Exception as e:
+                reply = f"error: {e}"
+            stream.write(f"{reply}\n".encode("utf-8"))
+    except OSError:
+        # The client went away (e.g. a daemon_running probe).
+        pass
+
+def daemon_running():
+    """Checks whether something is already listening on SOCKET_PATH."""
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(str(SOCKET_PATH))
+            return True
+        except OSError:
+            return False
+
+def serve():
+    """
+    Stays resident listening on SOCKET_PATH, so menu requests skip the
+    interpreter startup and reuse the warm in-process caches. Each
+    connection is handled in its own thread, as `tmux display-menu` only
+    returns once the menu is closed and prewarm requests shouldn't wait
+    for that. The protocol is one line in, one line out, so `nc -U` works
+    as a client. The socket path is published in the global tmux option
+    @tmux-actions-socket, which the tmux.conf bindings connect to.
+    """
+    import socket
+    import threading
+    if daemon_running():
+        print(f"Already serving on {SOCKET_PATH}", file=sys.stderr)
+        return
+    tmux_trace.finish("tmux-actions serve")
+
+    SOCKET_PATH.parent.mkdir(parents=True, exist_ok=True)
+    SOCKET_PATH.unlink(missing_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(SOCKET_PATH))
+    server.listen()
+    subprocess.run(["tmux", "set-option", "-g", "@tmux-actions-socket", str(SOCKET_PATH)])
+    try:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=serve_connection, args=(conn,), daemon=True).start()
+    finally:
+        server.close()
+        SOCKET_PATH.unlink(missing_ok=True)
+        subprocess.run(["tmux", "set-option", "-gu", "@tmux-actions-socket"])
+
+# Command line flags, in the order they take precedence, and the name each
+# run is traced under. Without any of them the menu is shown.
+FLAG_TRACE_NAMES = {
+    "--github": "github",
+    "--serve": "serve",
+    "--refresh-names": "refresh",
+    "--record": "record",
+    "--prewarm": "prewarm",
+}
 
 def main():
     """Main router: decides whether to show the menu or open GitHub."""
-    if "--github" in sys.argv:
-        try:
-            repo_path = sys.argv[sys.argv.index("--github") + 1]
-            open_github_repo(repo_path)
-        except IndexError:
+    flag = next((flag for flag in FLAG_TRACE_NAMES if flag in sys.argv), None)
+    tmux_trace.start(f"tmux-actions {FLAG_TRACE_NAMES.get(flag, 'menu')}", _IMPORT_START)
+
+    if flag == "--github":
+        idx = sys.argv.index("--github")
+        if len(sys.argv) > idx + 1:
+            repo_path = sys.argv[idx + 1]
+        else:
+            repo_path = tmux_query("pane_current_path")["pane_current_path"]
+        if not repo_path:
             display_tmux_message("Error: --github flag requires a path.")
+            return
+        open_github_repo(repo_path)
+    elif flag == "--serve":
+        serve()
+    elif flag == "--refresh-names":
+        idx = sys.argv.index("--refresh-names")
+        if len(sys.argv) < idx + 3:
+            return
+        with tmux_trace.phase("dynamic_names"):
+            refresh_dynamic_names(Path(sys.argv[idx + 1]), sys.argv[idx + 2:])
+    elif flag == "--record":
+        idx = sys.argv.index("--record")
+        if len(sys.argv) != idx + 3:
+            return
+        record_usage(sys.argv[idx + 1], sys.argv[idx + 2])
+    elif flag == "--prewarm":
+        idx = sys.argv.index("--prewarm")
+        if len(sys.argv) != idx + 2:
+            return
+        prewarm(sys.argv[idx + 1])
     else:
-        if len(sys.argv) < 2:
+        if len(sys.argv) >= 2:
+            show_menu(sys.argv[1])
+            return
+        # Without arguments, ask tmux for the pane path and client in one go.
+        current = tmux_query("pane_current_path", "client_name")
+        if not current["pane_current_path"]:
             display_tmux_message("Error: script requires a path argument.")
             return
-        show_menu(sys.argv[1])
+        show_menu(current["pane_current_path"], current["client_name"] or None)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the hot paths of tmux-uhm.py and tmux-actions.py on synthetic
+input, with tmux stubbed out: uhm matching and rendering over pane captures
+of 50 to 50k lines (plain and ANSI-colored, at several match densities),
+and actions file parsing and menu building.
+
+Reports latency percentiles and peak traced memory per case:
+
+    ./tmux-bench.py            # full run
+    ./tmux-bench.py --quick    # fewer sizes and repeats
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPT_DIR))
+from tmux_trace import percentile
+
+SIZES = [50, 500, 5000, 50000]
+QUICK_SIZES = [50, 500, 5000]
+# Fraction of words on a line that are something a rule matches
+DENSITIES = [0.01, 0.1, 0.3]
+
+FILLER = ["lorem", "ipsum", "dolor", "sit", "amet", "--verbose", "src/main.py:42", "OK", "200", "->"]
+ANSI = ["\x1b[31m", "\x1b[1;32m", "\x1b[38;5;240m", "\x1b[0m"]
+
+
+def load_script(name, path):
+    """Imports one of the hyphenated scripts as a module."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def matchable_words(rng):
+    """Words the default rules.py matches: SHAs, code paths and emails."""
+    return [
+        "".join(rng.choice("0123456789abcdef") for _ in range(40)),
+        f"/Users/ruben/code/project{rng.randint(0, 50)}/src/file{rng.randint(0, 99)}.py",
+        f"user{rng.randint(0, 30)}@example.com",
+    ]
+
+
+def synthetic_pane(lines, density, colored, seed=0):
+    """Returns a list of pane lines, like capture-pane -p [-e] would."""
+    rng = random.Random(seed)
+    pane = []
+    for _ in range(lines):
+        words = []
+        for _ in range(12):
+            if rng.random() < density:
+                word = rng.choice(matchable_words(rng))
+            else:
+                word = rng.choice(FILLER)
+            if colored and rng.random() < 0.3:
+                word = f"{rng.choice(ANSI)}{word}\x1b[0m"
+            words.append(word)
+        pane.append(" ".join(words))
+    return pane
+
+
+def synthetic_actions(entries, dynamic=0):
+    """Returns the text of an actions file with `entries` H2 entries."""
+    parts = ["# Bench Actions", ""]
+    for i in range(entries):
+        key = chr(ord("a") + i % 26)
+        if i < dynamic:
+            parts += [f"## [`{key}`] `Dynamic {i}`", "", "```", f"echo name {i}", "```", ""]
+        elif i % 3 == 0:
+            parts += [f"## [`!{key}`] Send {i}", "", f"> `make target{i}`", ""]
+        else:
+            parts += [f"## [`{key}`] Run {i}", "", "```", f"echo {i}", f"echo done {i}", "```", ""]
+        if i % 10 == 9:
+            parts += ["---", ""]
+    return "\n".join(parts)
+
+
+def measure(func, repeat):
+    """Runs func `repeat` times. Returns (latencies in ms, peak KiB)."""
+    func()  # warm up caches and the re module
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latencies, peak / 1024
+
+
+def report(name, latencies, peak_kib):
+    print(
+        f"{name:<44} p50 {statistics.median(latencies):9.2f} ms"
+        f"  p95 {percentile(latencies, 95):9.2f} ms"
+        f"  max {max(latencies):9.2f} ms"
+        f"  peak {peak_kib:10.1f} KiB"
+    )
+
+
+def bench_uhm(sizes, repeat):
+    uhm = load_script("tmux_uhm", SCRIPT_DIR / "uhm" / "tmux-uhm.py")
+    rules = uhm.validate_rules(uhm.load_rules_from_path(SCRIPT_DIR / "uhm" / "rules.py"))
+    combined = uhm.compile_rules(rules)
+
+    print("== tmux-uhm: match + label (screen mode), then render ==")
+    for size in sizes:
+        for colored in (False, True):
+            for density in DENSITIES:
+                pane = synthetic_pane(size, density, colored)
+                runs = max(3, repeat * 50 // size)
+                label = f"{size:>6} lines {'ansi ' if colored else 'plain'} d={density:<4}"
+
+                latencies, peak = measure(lambda: uhm.annotate_screen(pane, rules, combined), runs)
+                report(f"parse  {label}", latencies, peak)
+
+                annotated, matches, _ = uhm.annotate_screen(pane, rules, combined)
+                latencies, peak = measure(lambda: uhm.render_lines(annotated, matches, rules), runs)
+                report(f"render {label}", latencies, peak)
+
+    print("== tmux-uhm: scrollback mode ==")
+    for size in sizes:
+        pane = synthetic_pane(size, 0.1, True)
+        runs = max(3, repeat * 50 // size)
+        latencies, peak = measure(lambda: uhm.annotate_history(iter(pane), rules, combined), runs)
+        report(f"history {size:>6} lines ansi  d=0.1", latencies, peak)
+
+    print("== tmux-uhm: fuzzy search, one keystroke ==")
+    for count in (676, 5000):
+        rng = random.Random(count)
+        entries = [[0, 0, rng.choice(matchable_words(rng))] for _ in range(count)]
+        lines, index = uhm.build_search_index(entries)
+        # Between keys, fuzzy_search narrows the index to what still matches
+        latencies, peak = measure(lambda: uhm.narrow_index(lines, index, "u"), repeat)
+        report(f"search {count:>5} entries, narrowing", latencies, peak)
+        narrowed = {query: uhm.narrow_index(lines, index, query) for query in ("u", "p")}
+        for name, base, query in (("first key", index, "e"), ("second key", narrowed["u"], "us"), ("no match", narrowed["p"], "pu")):
+            # A new query means new patterns, so keep the re cache out of it
+            latencies, peak = measure(lambda: (uhm.re.purge(), uhm.narrow_search(lines, base, query, 40)), repeat)
+            report(f"search {count:>5} entries, {name}", latencies, peak)
+
+
+def bench_actions(repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep the benchmark's caches away from the real ones.
+        os.environ["XDG_CACHE_HOME"] = os.path.join(tmp, "cache")
+        actions = load_script("tmux_actions", SCRIPT_DIR / "tmux-actions.py")
+
+        def fake_run(args, *popenargs, **kwargs):
+            if isinstance(args, list) and args[0] == "tmux":
+                return None
+            return real_run(args, *popenargs, **kwargs)
+
+        real_run = actions.subprocess.run
+        actions.subprocess.run = fake_run
+        try:
+            print("== tmux-actions: parse and show_menu (tmux stubbed) ==")
+            for entries in (5, 50, 500):
+                content = synthetic_actions(entries)
+                latencies, peak = measure(lambda: actions.parse_actions(content), repeat)
+                report(f"parse_actions {entries:>4} entries", latencies, peak)
+
+                project = Path(tmp) / f"project{entries}"
+                project.mkdir()
+                (project / ".tmux-actions.md").write_text(content)
+                latencies, peak = measure(lambda: actions.show_menu(str(project)), repeat)
+                report(f"show_menu     {entries:>4} entries (warm)", latencies, peak)
+
+            project = Path(tmp) / "dynamic"
+            project.mkdir()
+            (project / ".tmux-actions.md").write_text(synthetic_actions(10, dynamic=6))
+            latencies, peak = measure(lambda: actions.show_menu(str(project)), repeat)
+            report("show_menu       10 entries, 6 dynamic cached", latencies, peak)
+        finally:
+            actions.subprocess.run = real_run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="fewer sizes and repeats")
+    parser.add_argument("--repeat", type=int, default=None, help="runs per case (default 20, 5 with --quick)")
+    parser.add_argument("--only", choices=["uhm", "actions"], help="run only one of the suites")
+    args = parser.parse_args()
+
+    repeat = args.repeat or (5 if args.quick else 20)
+    sizes = QUICK_SIZES if args.quick else SIZES
+    print(f"Python {sys.version.split()[0]}, {repeat} runs per case (fewer on large captures)")
+    if args.only in (None, "uhm"):
+        bench_uhm(sizes, repeat)
+    if args.only in (None, "actions"):
+        bench_actions(repeat)
+
+
+if __name__ == "__main__":
+    main()
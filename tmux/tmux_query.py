@@ -0,0 +1,53 @@
+"""
+Shared helpers to read tmux state with as few tmux invocations as possible.
+
+Used by tmux-actions.py and uhm/tmux-uhm.py. Both scripts are usually run
+through symlinks, so they add this file's directory to sys.path themselves.
+"""
+
+import subprocess
+
+# Unit separator: never part of a tmux format value we care about
+FIELD_SEP = "\x1f"
+
+def tmux_query(*fields, target=None):
+    """
+    Expands several tmux format variables (e.g. "pane_width") with a single
+    `tmux display-message -p` call. Returns a dict of field -> value, with
+    empty strings for every field if tmux can't be reached.
+    """
+    format_string = FIELD_SEP.join(f"#{{{field}}}" for field in fields)
+    cmd = ["tmux", "display-message", "-p"]
+    if target:
+        cmd += ["-t", target]
+    cmd.append(format_string)
+    try:
+        output = subprocess.check_output(cmd).decode("utf-8").rstrip("\n")
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return {field: "" for field in fields}
+
+    values = output.split(FIELD_SEP)
+    values += [""] * (len(fields) - len(values))
+    return dict(zip(fields, values))
+
+def tmux_list_panes(*fields, target=None):
+    """
+    Like tmux_query, but for every pane of the current (or `target`) window
+    with a single `tmux list-panes` call. Returns a list of dicts, empty if
+    tmux can't be reached.
+    """
+    format_string = FIELD_SEP.join(f"#{{{field}}}" for field in fields)
+    cmd = ["tmux", "list-panes", "-F", format_string]
+    if target:
+        cmd += ["-t", target]
+    try:
+        output = subprocess.check_output(cmd).decode("utf-8")
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return []
+
+    panes = []
+    for line in output.splitlines():
+        values = line.split(FIELD_SEP)
+        values += [""] * (len(fields) - len(values))
+        panes.append(dict(zip(fields, values)))
+    return panes
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Opt-in per-phase timing for tmux-actions.py and uhm/tmux-uhm.py.
+
+Set TMUX_TRACE=1 (e.g. `set-environment -g TMUX_TRACE 1` in tmux) and each
+run appends one JSON line with its phase timings to
+$XDG_CACHE_HOME/tmux-trace/trace.jsonl, rotated to trace.jsonl.1 once it
+grows past MAX_TRACE_BYTES. Run this file to summarize p50/p95 per phase:
+
+    python3 tmux_trace.py [--script tmux-actions]
+
+Interpreter startup before a script's first line can't be seen from inside
+it, so compare `total` with the latency you feel to estimate it.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("TMUX_TRACE", "") not in ("", "0")
+TRACE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "tmux-trace")
+TRACE_FILE = os.path.join(TRACE_DIR, "trace.jsonl")
+MAX_TRACE_BYTES = 1024 * 1024
+
+class _Run(threading.local):
+    """What has been recorded so far, per thread (a daemon serves requests concurrently)."""
+    def __init__(self):
+        self.phases = {}
+        self.started = None
+
+_run = _Run()
+
+def start(script, import_start=None):
+    """
+    Starts tracing a run of `script`. With `import_start` (a perf_counter
+    taken on the script's first line), the time since then is recorded as
+    the import phase and the record is written at exit unless finish() is
+    called first. Without it, the run starts now (e.g. a daemon request).
+    """
+    if not ENABLED:
+        return
+    if import_start is None:
+        _run.started = time.perf_counter()
+        return
+    _run.started = import_start
+    record("import", time.perf_counter() - import_start)
+    atexit.register(finish, script)
+
+def record(name, seconds):
+    """Adds `seconds` to the phase `name`."""
+    if ENABLED:
+        _run.phases[name] = _run.phases.get(name, 0.0) + seconds
+
+@contextmanager
+def phase(name):
+    """Times the enclosed block as (part of) the phase `name`."""
+    if not ENABLED:
+        yield
+        return
+    phase_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - phase_start)
+
+def finish(script):
+    """
+    Appends the phases recorded so far (in this thread) as one JSON line and
+    resets them, so long-running processes can call it once per request.
+    """
+    if not ENABLED or not _run.phases:
+        return
+    now = time.perf_counter()
+    entry = {
+        "script": script,
+        "time": time.time(),
+        "pid": os.getpid(),
+        "phases": {name: round(seconds * 1000, 3) for name, seconds in _run.phases.items()},
+        "total": round((now - _run.started) * 1000, 3) if _run.started is not None else None,
+    }
+    _run.phases.clear()
+    _run.started = now
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        if os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE) > MAX_TRACE_BYTES:
+            os.replace(TRACE_FILE, TRACE_FILE + ".1")
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError:
+        pass
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    idx = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+def summarize(script_filter=None):
+    """Prints count, p50 and p95 per script and phase from the trace logs."""
+    timings = {}
+    for path in (TRACE_FILE + ".1", TRACE_FILE):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if script_filter and not entry["script"].startswith(script_filter):
+                continue
+            phases = timings.setdefault(entry["script"], {})
+            for name, ms in entry["phases"].items():
+                phases.setdefault(name, []).append(ms)
+            if entry.get("total") is not None:
+                phases.setdefault("total", []).append(entry["total"])
+
+    if not timings:
+        print(f"No traces in {TRACE_FILE}. Run with TMUX_TRACE=1 first.")
+        return
+    for script, phases in sorted(timings.items()):
+        print(script)
+        for name, values in phases.items():
+            print(f"  {name:<16} n={len(values):<5} p50 {percentile(values, 50):9.2f} ms  p95 {percentile(values, 95):9.2f} ms")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--script":
+        summarize(sys.argv[2])
+    elif len(sys.argv) == 1:
+        summarize()
+    else:
+        print("Usage: python3 tmux_trace.py [--script <name>]")
+        sys.exit(1)
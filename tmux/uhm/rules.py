@@ -8,9 +8,10 @@ RULES = [
         "color": "highlight_orange",
         # The `cd` command is now explicitly part of the command string.
         # The 'path' argument to the lambda contains the pane's current directory.
+        # `gh` is chained with && so the command fails (and isn't cached) when it does.
         "action": lambda text, path: (
             "exco",
-            f"cd '{path}' && echo https://github.com/$(gh repo view --json nameWithOwner -q .nameWithOwner)/commit/{text}"
+            f"cd '{path}' && nwo=$(gh repo view --json nameWithOwner -q .nameWithOwner) && echo https://github.com/$nwo/commit/{text}"
         )
     },
     {
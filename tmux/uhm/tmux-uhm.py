@@ -1,16 +1,50 @@
 #!/usr/bin/env python3
 
+import time
+_IMPORT_START = time.perf_counter()
 import sys
 import os
 import subprocess
 import re
 import tempfile
+import shutil
+import json
+import errno
 import importlib.util
+from collections import Counter
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from tmux_query import tmux_query, tmux_list_panes
+import tmux_trace
 
 # --- Configuration ---
 # Delimiters for the labels shown in the UI
 L_DELIM = "⠐"
 R_DELIM = "⠂"
+# Characters labels are made of. Up to len(LABEL_CHARS) matches get
+# single-character labels; beyond that some labels grow a second character.
+LABEL_CHARS = "abcdefghijklmnopqrstuvwxyz"
+MAX_LABELS = len(LABEL_CHARS) ** 2
+# Seconds parse mode waits for the popup to pick up the matches
+HANDOFF_TIMEOUT = 5
+
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "tmux-uhm")
+ACTION_CACHE_FILE = os.path.join(CACHE_DIR, "action-outputs.json")
+# Seconds exco/exty outputs are reused, unless a rule sets its own "cache_ttl"
+ACTION_CACHE_TTL = 600
+# Entries older than this are dropped from the cache file whatever their TTL
+MAX_ACTION_CACHE_AGE = 7 * 24 * 3600
+# Validated rule specs, keyed by rules file path, mtime and size
+RULES_CACHE_FILE = os.path.join(CACHE_DIR, "rules.json")
+
+ACTION_TYPES = ("copy", "exec", "exco", "type", "exty")
+
+# Backreferences (\1-\9 not preceded by an escaped backslash, or (?P=name))
+# would point at the wrong group once the rules are combined
+BACKREF_RE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]|\(\?P=')
+# Matches the SGR escape sequences tmux capture-pane -e emits
+ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
 
 # --- ANSI Color Definitions ---
 COLORS = {
@@ -30,15 +64,6 @@ def colorize(text, color_name):
         return text
     return f"\033[{code}m{text}\033[0m"
 
-def get_tmux_info(format_string):
-    """Runs a tmux display-message command and returns the output."""
-    try:
-        return subprocess.check_output(
-            ["tmux", "display-message", "-p", format_string]
-        ).decode("utf-8").strip()
-    except subprocess.CalledProcessError:
-        return ""
-
 def get_key():
     """Gets a single keypress from the user without requiring Enter."""
     import tty
@@ -59,136 +84,846 @@ def load_rules_from_path(path):
     spec.loader.exec_module(rules_module)
     return rules_module.RULES
 
-def parse_mode(rules_path, pane_path):
+def validate_rules(rules):
     """
-    Captures pane content, finds matches, writes temp files,
-    and launches the displayer in a tmux popup.
+    Checks every rule (regex syntax, known color, known action type) and
+    returns their plain, JSON-friendly specs: regex, color and cache_ttl.
+    Callable actions are probed with placeholder arguments to read their
+    type. Raises ValueError listing every problem found.
     """
+    specs = []
+    problems = []
+    for i, rule in enumerate(rules):
+        regex = rule.get("regex")
+        try:
+            re.compile(regex)
+        except (re.error, TypeError) as e:
+            problems.append(f"rule {i}: bad regex {regex!r}: {e}")
+        color = rule.get("color")
+        if color not in COLORS:
+            problems.append(f"rule {i}: unknown color {color!r}")
+        action = rule.get("action")
+        try:
+            if callable(action):
+                action_type = action("PLACEHOLDER", "PANE_PATH")[0]
+            else:
+                action_type = action.split(" ", 1)[0]
+        except Exception as e:
+            problems.append(f"rule {i}: bad action: {e}")
+        else:
+            if action_type not in ACTION_TYPES:
+                problems.append(f"rule {i}: unknown action type {action_type!r}")
+        specs.append({"regex": regex, "color": color, "cache_ttl": rule.get("cache_ttl")})
+    if problems:
+        raise ValueError("; ".join(problems))
+    return specs
+
+def read_json(path):
+    """Loads a JSON cache file, or an empty dict if missing or corrupt."""
     try:
-        rules = load_rules_from_path(rules_path)
-    except Exception as e:
-        subprocess.run(["tmux", "display-message", f"Error loading rules: {e}"])
-        sys.exit(1)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_json(path, data):
+    """Atomically writes a JSON cache file. Failures are ignored."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def load_rule_bundle(rules_path):
+    """
+    Returns the validated rule specs for a rules file. They are cached on
+    disk keyed by the file's path, mtime and size, so rules.py is only
+    executed (and validated) again after it changes.
+    """
+    stat = os.stat(rules_path)
+    cache_key = os.path.realpath(rules_path)
+    cache = read_json(RULES_CACHE_FILE)
+    cached = cache.get(cache_key)
+    if cached and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+        return cached["rules"]
+
+    specs = validate_rules(load_rules_from_path(rules_path))
+    cache[cache_key] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "rules": specs}
+    write_json(RULES_CACHE_FILE, cache)
+    return specs
+
+def compile_rules(rules):
+    """
+    Compiles all rule regexes into a single alternation with one named group
+    per rule, so each line is scanned once. Alternatives are tried in rule
+    order, so the earliest match wins and ties go to the first rule, as with
+    sorting the per-rule matches. Scanning then resumes right after each
+    match, so text a rule matched only as part of an overlapping match is
+    still found: with `ab` and `b+` on "abbb", "bb" is labeled too, where
+    the per-rule scan skips the overlapping "bbb". Returns None if the rules
+    can't be combined (they use backreferences or global inline flags).
+    """
+    if any(BACKREF_RE.search(rule["regex"]) for rule in rules):
+        return None
+    try:
+        return re.compile("|".join(
+            f"(?P<_r{i}>{rule['regex']})" for i, rule in enumerate(rules)
+        ))
+    except re.error:
+        return None
+
+def find_matches(plain_line, rules, combined):
+    """
+    Yields non-overlapping (start, end, text, rule_idx) tuples for a line,
+    left to right. Falls back to scanning rule by rule without `combined`.
+    """
+    if combined is not None:
+        for match in combined.finditer(plain_line):
+            rule_idx = int(match.lastgroup[2:])
+            yield match.start(), match.end(), match.group(0), rule_idx
+        return
+
+    all_found_matches = []
+    for i, rule in enumerate(rules):
+        for match in re.finditer(rule["regex"], plain_line):
+            all_found_matches.append((match.start(), match.end(), match.group(0), i))
+    all_found_matches.sort(key=lambda x: x[0])
+
+    last_pos = 0
+    for found in all_found_matches:
+        if found[0] < last_pos:
+            continue
+        last_pos = found[1]
+        yield found
+
+def capture_pane_lines(history=None):
+    """
+    Streams the pane content line by line, including color formatting.
+    With `history`, also includes that many lines of scrollback.
+    """
+    capture_cmd = ["tmux", "capture-pane", "-p", "-e"]
+    if history:
+        capture_cmd += ["-S", f"-{history}"]
+    with subprocess.Popen(
+        capture_cmd, stdout=subprocess.PIPE, encoding="utf-8", errors="replace"
+    ) as proc:
+        for line in proc.stdout:
+            yield line.rstrip("\n")
 
-    # Capture pane content, including color formatting
-    pane_content = subprocess.check_output(
-        ["tmux", "capture-pane", "-p", "-e"]
-    ).decode("utf-8")
+def generate_labels(count):
+    """
+    Returns `count` prefix-free labels, shortest first (vimium style):
+    single characters while they suffice, then the first ones turn into
+    prefixes for two-character labels, and so on.
+    """
+    labels = [""]
+    offset = 0
+    while len(labels) - offset < count or len(labels) == 1:
+        prefix = labels[offset]
+        offset += 1
+        labels.extend(prefix + char for char in LABEL_CHARS)
+    return labels[offset:offset + count]
+
+def label_for(rule_idx, text, labels, keys_by_match, matches_data, pane_path=None):
+    """
+    Returns the label for a match, reusing the one already given to the
+    same text and rule (in the same pane path, when given), or taking the
+    next from `labels`. Returns None once labels run out.
+    """
+    key = keys_by_match.get((rule_idx, text, pane_path))
+    if key is None:
+        key = next(labels, None)
+        if key is None:
+            return None
+        keys_by_match[(rule_idx, text, pane_path)] = key
+        matches_data[key] = {"text": text, "rule_idx": rule_idx}
+        if pane_path is not None:
+            matches_data[key]["pane_path"] = pane_path
+    return key
 
-    label_idx = 0
+def split_ansi(line):
+    """
+    Splits a captured line into its plain text and escape sequences in a
+    single pass. Returns (plain_line, escapes), where each escape is
+    (plain_offset, orig_start, orig_end) and plain_offset is the position
+    in plain_line of the character it comes right before.
+    """
+    if "\x1b" not in line:
+        return line, []
+    plain_parts = []
+    escapes = []
+    last = 0
+    removed = 0
+    for m in ANSI_RE.finditer(line):
+        plain_parts.append(line[last:m.start()])
+        escapes.append((m.start() - removed, m.start(), m.end()))
+        removed += m.end() - m.start()
+        last = m.end()
+    plain_parts.append(line[last:])
+    return "".join(plain_parts), escapes
+
+def map_spans(line, escapes, labeled):
+    """
+    Maps labeled (start, end, key) spans on the plain line back onto the
+    original escaped line. Returns (orig_start, orig_end, key, restore)
+    tuples, where restore holds the SGR sequences active where the span
+    ends, to re-apply after the hint's own reset.
+    """
+    if not escapes:
+        return [(start, end, key, "") for start, end, key in labeled]
+    mapped = []
+    active = []
+    shift = 0
+    idx = 0
+    for start, end, key in labeled:
+        # Escapes right before the first character stay outside the hint...
+        while idx < len(escapes) and escapes[idx][0] <= start:
+            _, orig_start, orig_end = escapes[idx]
+            active = apply_sgr(active, line[orig_start:orig_end])
+            shift += orig_end - orig_start
+            idx += 1
+        span_start = start + shift
+        # ...while the ones inside it are replaced by the hint colors.
+        while idx < len(escapes) and escapes[idx][0] < end:
+            _, orig_start, orig_end = escapes[idx]
+            active = apply_sgr(active, line[orig_start:orig_end])
+            shift += orig_end - orig_start
+            idx += 1
+        mapped.append((span_start, end + shift, key, "".join(active)))
+    return mapped
+
+def apply_sgr(active, sequence):
+    """Returns the SGR sequences in effect after `sequence`."""
+    params = sequence[2:-1]
+    if params in ("", "0"):
+        return []
+    if params.startswith("0;"):
+        return [sequence]
+    return active + [sequence]
+
+def find_line_matches(lines, rules, combined):
+    """
+    Splits every line into plain text and escapes and finds its matches.
+    Returns a list of (line, escapes, found), one per line.
+    """
+    found_lines = []
+    for line in lines:
+        # Match on the plain text, but keep the escapes to map spans back
+        plain_line, escapes = split_ansi(line)
+        found_lines.append((line, escapes, list(find_matches(plain_line, rules, combined))))
+    return found_lines
+
+def label_lines(found_lines, pane_paths=None):
+    """
+    Labels the matches of find_line_matches bottom up, keeping every line,
+    so the matches nearest the prompt get the shortest labels, as in
+    annotate_history. Repeated texts share the label of the bottom-most
+    occurrence. Returns (annotated_lines,
+    matches_data), where each annotated line is (line, [(start, end, key,
+    restore), ...]) left to right, with offsets into the original escaped
+    line (see map_spans). With `pane_paths` (one per line, in window
+    mode), texts are only shared within the same path, and each match
+    records the path its action should run in.
+    """
+    if pane_paths is None:
+        pane_paths = [None] * len(found_lines)
+    unique_matches = {
+        (rule_idx, text, pane_path)
+        for (_, _, found), pane_path in zip(found_lines, pane_paths)
+        for _, _, text, rule_idx in found
+    }
+    labels = iter(generate_labels(min(len(unique_matches), MAX_LABELS)))
+    keys_by_match = {}
     matches_data = {}
     annotated_content = []
+    for (line, escapes, found), pane_path in zip(reversed(found_lines), reversed(pane_paths)):
+        labeled = []
+        for start, end, text, rule_idx in reversed(found):
+            key = label_for(rule_idx, text, labels, keys_by_match, matches_data, pane_path)
+            if key is None:
+                break
+            labeled.append((start, end, key))
+        annotated_content.append((line, map_spans(line, escapes, labeled[::-1])))
+    annotated_content.reverse()
 
-    for line in pane_content.splitlines():
-        all_found_matches = []
-        # We search on a color-stripped version of the line to find match positions
-        plain_line = re.sub(r'\x1b\[[0-9;]*m', '', line)
-        for i, rule in enumerate(rules):
-            for match in re.finditer(rule["regex"], plain_line):
-                all_found_matches.append({"match": match, "rule_idx": i})
-        
-        all_found_matches.sort(key=lambda x: x["match"].start())
+    return annotated_content, matches_data
 
-        new_line = ""
-        last_pos = 0
-        for found in all_found_matches:
-            match = found["match"]
-            
-            if match.start() < last_pos:
-                continue
+def search_entries(found_lines, pane_paths=None):
+    """
+    Lists every match of find_line_matches for fuzzy_search, labeled or
+    not, top to bottom. Returns (entries, context): each entry is
+    [context_idx, rule_idx, text] (plus the pane path, with `pane_paths`),
+    and context holds the plain text of the lines with matches.
+    """
+    if pane_paths is None:
+        pane_paths = [None] * len(found_lines)
+    entries = []
+    context = []
+    for (line, _, found), pane_path in zip(found_lines, pane_paths):
+        if not found:
+            continue
+        for _, _, text, rule_idx in found:
+            entry = [len(context), rule_idx, text]
+            if pane_path is not None:
+                entry.append(pane_path)
+            entries.append(entry)
+        context.append(split_ansi(line)[0])
+    return entries, context
 
-            if label_idx < 26:
-                key = chr(ord('a') + label_idx)
-                matches_data[key] = {"text": match.group(0), "rule_idx": found["rule_idx"]}
-                # We perform replacements on the plain line
-                new_line += plain_line[last_pos:match.start()]
-                new_line += f"%%LABEL_{key}%%"
-                last_pos = match.end()
-                label_idx += 1
-            else:
-                break
-        
-        new_line += plain_line[last_pos:]
-        annotated_content.append(new_line)
+def annotate_screen(lines, rules, combined):
+    """
+    Labels a pane capture with label_lines. Returns (annotated_lines,
+    matches_data, search), search being what search_entries returns.
+    """
+    found_lines = find_line_matches(lines, rules, combined)
+    return (*label_lines(found_lines), search_entries(found_lines))
 
-    with tempfile.NamedTemporaryFile(mode='w+', delete=False) as match_file, \
-         tempfile.NamedTemporaryFile(mode='w+', delete=False) as content_file:
-        
-        for key, data in matches_data.items():
-            match_file.write(f"{key}:{data['rule_idx']}:{data['text']}\n")
-        
-        content_file.write("\n".join(annotated_content))
-        
-        match_filepath = match_file.name
-        content_filepath = content_file.name
-
-    pane_w = get_tmux_info("#{pane_width}")
-    pane_h = get_tmux_info("#{pane_height}")
-    pane_l = get_tmux_info("#{pane_left}")
-    pane_t = get_tmux_info("#{pane_top}")
-    
-    script_path = os.path.abspath(__file__)
+def annotate_history(lines, rules, combined):
+    """
+    Labels matches newest first (bottom up) over a scrollback capture, so
+    the newest matches get the shortest labels. Repeated texts share the
+    label of the newest occurrence, and only the line holding the newest
+    occurrence of each of the newest MAX_LABELS distinct matches is kept,
+    so memory stays bounded and repeats don't crowd out older matches.
+    Every match still goes into the search entries (see search_entries),
+    newest first, with just the plain text of its line. Returns
+    (annotated_lines, matches_data, search).
+    """
+    recent = {}  # line number -> (line, escapes, found), oldest first
+    newest = {}  # (rule_idx, text) -> number of the newest line holding it
+    owned = Counter()  # line number -> how many matches it holds the newest of
+    entries = []
+    context = []
+    for line_no, line in enumerate(lines):
+        plain_line, escapes = split_ansi(line)
+        found = list(find_matches(plain_line, rules, combined))
+        if not found:
+            continue
+        entries.extend([len(context), rule_idx, text] for _, _, text, rule_idx in found)
+        context.append(plain_line)
+        for match in {(rule_idx, text) for _, _, text, rule_idx in found}:
+            older = newest.get(match)
+            if older is not None:
+                owned[older] -= 1
+                # Everything on that line repeats further down
+                if not owned[older]:
+                    del owned[older], recent[older]
+            newest[match] = line_no
+            owned[line_no] += 1
+        recent[line_no] = (line, escapes, found)
+        # Drop the oldest line once the newer ones already fill all labels.
+        oldest = next(iter(recent))
+        while len(newest) - owned[oldest] >= MAX_LABELS:
+            for _, _, text, rule_idx in recent.pop(oldest)[2]:
+                if newest.get((rule_idx, text)) == oldest:
+                    del newest[(rule_idx, text)]
+            del owned[oldest]
+            oldest = next(iter(recent))
 
-    popup_cmd = [
-        "tmux", "popup", "-B", "-E",
-        "-w", pane_w, "-h", pane_h, "-x", pane_l, "-y", pane_t,
-        "--", sys.executable, script_path, "display", rules_path, pane_path, match_filepath, content_filepath
-    ]
-    subprocess.run(popup_cmd)
+    labels = iter(generate_labels(min(len(newest), MAX_LABELS)))
+    keys_by_match = {}
+    matches_data = {}
+    annotated_content = []
+    for line, escapes, found in reversed(recent.values()):
+        labeled = []
+        for start, end, text, rule_idx in reversed(found):
+            key = label_for(rule_idx, text, labels, keys_by_match, matches_data)
+            if key is None:
+                break
+            labeled.append((start, end, key))
+        annotated_content.append((line, map_spans(line, escapes, labeled[::-1])))
+    annotated_content.reverse()
+    entries.reverse()
 
+    return annotated_content, matches_data, (entries, context)
 
-def display_mode(rules_path, pane_path, match_filepath, content_filepath):
+def capture_window_panes():
     """
-    Reads annotated files, renders final output, and handles user interaction.
+    Captures every visible pane of the current window, all at once. Returns
+    a list of (pane, lines) in reading order (top to bottom, then left to
+    right), where pane is a dict with its id, position and current path.
     """
+    panes = tmux_list_panes(
+        "pane_id", "pane_left", "pane_top", "pane_current_path", "pane_active", "window_zoomed_flag"
+    )
+    # A zoomed window only shows its active pane
+    if panes and panes[0]["window_zoomed_flag"] == "1":
+        panes = [pane for pane in panes if pane["pane_active"] == "1"]
+    panes.sort(key=lambda pane: (int(pane["pane_top"]), int(pane["pane_left"])))
+
+    procs = [
+        subprocess.Popen(
+            ["tmux", "capture-pane", "-p", "-e", "-t", pane["pane_id"]],
+            stdout=subprocess.PIPE, encoding="utf-8", errors="replace",
+        )
+        for pane in panes
+    ]
+    captures = []
+    for pane, proc in zip(panes, procs):
+        output, _ = proc.communicate()
+        captures.append((pane, output.rstrip("\n").split("\n")))
+    return captures
+
+def load_rules_or_exit(rules_path):
+    """Loads the rule bundle, reporting errors in the status line."""
     try:
-        rules = load_rules_from_path(rules_path)
+        with tmux_trace.phase("rules"):
+            return load_rule_bundle(rules_path)
     except Exception as e:
-        print(f"Error loading rules: {e}")
+        subprocess.run(["tmux", "display-message", f"Error loading rules: {e}"])
         sys.exit(1)
 
-    matches = {}
-    with open(match_filepath, 'r') as f:
-        for line in f:
-            key, rule_idx_str, text = line.strip().split(':', 2)
-            matches[key] = {"text": text, "rule_idx": int(rule_idx_str)}
-    
-    with open(content_filepath, 'r') as f:
-        annotated_content = f.read()
-
-    # Define raw escape codes for precise control over coloring
-    DULL_CODE = f"\033[{COLORS['dull']}m"
+def parse_mode(rules_path, pane_path, history=None):
+    """
+    Captures pane content, finds matches, and launches the displayer in a
+    tmux popup, handing the matches over through a FIFO. With `history`,
+    the scrollback is streamed too and only lines with matches are shown.
+    """
+    rules = load_rules_or_exit(rules_path)
+
+    # The capture is streamed, so its time is part of the matching phase.
+    with tmux_trace.phase("capture_match"):
+        combined = compile_rules(rules)
+        lines = capture_pane_lines(history)
+        if history:
+            annotated_content, matches_data, search = annotate_history(lines, rules, combined)
+        else:
+            annotated_content, matches_data, search = annotate_screen(lines, rules, combined)
+
+    payload = json.dumps({
+        "matches": {key: [data["rule_idx"], data["text"]] for key, data in matches_data.items()},
+        "lines": annotated_content,
+        "rules": rules,
+        "search": search,
+    })
+
+    with tmux_trace.phase("tmux"):
+        pane = tmux_query("pane_width", "pane_height", "pane_left", "pane_top")
+
+    geometry = [
+        "-w", pane["pane_width"], "-h", pane["pane_height"],
+        "-x", pane["pane_left"], "-y", pane["pane_top"],
+    ]
+    show_popup(payload, geometry, rules_path, pane_path, "parse")
+
+def window_mode(rules_path, pane_path):
+    """
+    Like parse_mode, but over every visible pane of the window: the panes
+    are captured concurrently, then matched and labeled in a single label
+    space, and the popup covers the whole window with each pane's
+    lines drawn where the pane is. Actions run in the path of the pane the
+    match came from.
+    """
+    rules = load_rules_or_exit(rules_path)
+
+    with tmux_trace.phase("capture"):
+        captures = capture_window_panes()
+    with tmux_trace.phase("match"):
+        combined = compile_rules(rules)
+        # A process pool costs more to start than the few hundred visible
+        # lines of a window take to match, so panes are matched in turn.
+        pane_matches = [find_line_matches(lines, rules, combined) for _, lines in captures]
+        found_lines = [found_line for pane_lines in pane_matches for found_line in pane_lines]
+        pane_paths = [
+            pane["pane_current_path"] for (pane, _), pane_lines in zip(captures, pane_matches) for _ in pane_lines
+        ]
+        annotated_content, matches_data = label_lines(found_lines, pane_paths)
+        search = search_entries(found_lines, pane_paths)
+
+    # Where each line goes on screen
+    origins = [
+        [int(pane["pane_top"]) + row, int(pane["pane_left"])]
+        for (pane, _), pane_lines in zip(captures, pane_matches)
+        for row in range(len(pane_lines))
+    ]
+
+    payload = json.dumps({
+        "matches": {
+            key: [data["rule_idx"], data["text"], data["pane_path"]]
+            for key, data in matches_data.items()
+        },
+        "lines": annotated_content,
+        "rules": rules,
+        "origins": origins,
+        "search": search,
+    })
+
+    with tmux_trace.phase("tmux"):
+        window = tmux_query("window_width", "window_height")
+
+    geometry = ["-w", window["window_width"], "-h", window["window_height"], "-x", "0", "-y", "0"]
+    show_popup(payload, geometry, rules_path, pane_path, "window")
+
+def show_popup(payload, geometry, rules_path, pane_path, mode):
+    """
+    Launches the displayer in a tmux popup with the given size and position
+    arguments, and hands it the payload through a FIFO. `mode` names the
+    run in the trace log.
+    """
+    script_path = os.path.abspath(__file__)
+
+    # The popup runs under the tmux server, not as our child, so hand the
+    # payload over through a FIFO in a private directory instead of files.
+    handoff_dir = tempfile.mkdtemp(prefix="tmux-uhm-")
+    fifo_path = os.path.join(handoff_dir, "handoff")
+    try:
+        os.mkfifo(fifo_path, 0o600)
+        popup_cmd = [
+            "tmux", "popup", "-B", "-E", *geometry,
+            "--", sys.executable, script_path, "display", rules_path, pane_path, fifo_path
+        ]
+        with tmux_trace.phase("handoff"):
+            popup = subprocess.Popen(popup_cmd)
+            send_handoff(fifo_path, handoff_dir, payload, popup)
+        # Don't count the time the popup stays open
+        tmux_trace.finish(f"tmux-uhm {mode}")
+        popup.wait()
+    finally:
+        shutil.rmtree(handoff_dir, ignore_errors=True)
+
+def send_handoff(fifo_path, handoff_dir, payload, popup):
+    """
+    Waits (up to HANDOFF_TIMEOUT, and only while the `popup` process runs)
+    for the displayer to open the FIFO, then writes the payload. The FIFO
+    is removed as soon as both ends are open, so nothing is left behind
+    even if the popup is killed.
+    """
+    deadline = time.monotonic() + HANDOFF_TIMEOUT
+    while True:
+        try:
+            fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            # ENXIO: nobody has opened the reading end yet
+            if e.errno != errno.ENXIO or time.monotonic() > deadline or popup.poll() is not None:
+                return
+            time.sleep(0.005)
+
+    shutil.rmtree(handoff_dir, ignore_errors=True)
+    os.set_blocking(fd, True)
+    with os.fdopen(fd, "w", encoding="utf-8") as fifo:
+        try:
+            fifo.write(payload)
+        except BrokenPipeError:
+            pass
+
+def match_data(entry):
+    """Turns a [rule_idx, text(, pane_path)] payload entry into a match dict."""
+    data = {"rule_idx": entry[0], "text": entry[1]}
+    if len(entry) > 2:
+        data["pane_path"] = entry[2]
+    return data
+
+def receive_handoff(fifo_path):
+    """
+    Reads the payload parse_mode or window_mode sends through the FIFO.
+    Returns (matches, lines, rules, origins, search), origins being None
+    unless the lines come from several panes, and search the (entries,
+    context) of search_entries.
+    """
+    with open(fifo_path, "r", encoding="utf-8") as fifo:
+        data = json.load(fifo)
+    matches = {key: match_data(entry) for key, entry in data["matches"].items()}
+    return matches, data["lines"], data["rules"], data.get("origins"), data["search"]
+
+
+def render_lines(annotated_lines, matches, rules, typed="", origins=None):
+    """
+    Renders the annotated lines in the pane's own colors, with each labeled
+    span replaced by its label and the colored match, after which the
+    colors in effect at that point of the line are restored. Every fragment
+    is built once per key, and each line is assembled in a single left to
+    right pass over its spans. Once some label characters have been
+    `typed`, only the labels starting with them are shown, with the typed
+    part dropped; the other matches are left as they were. With `origins`
+    (window mode), each line is drawn at its [row, column] instead of
+    below the previous one.
+    """
     RESET_CODE = f"\033[{COLORS['reset']}m"
 
-    # Process line by line, starting from the cleaned (color-stripped) text
+    fragments = {}
+    for key, data in matches.items():
+        if not key.startswith(typed):
+            continue
+        rule = rules[data["rule_idx"]]
+        label_display = colorize(f"{L_DELIM}{key[len(typed):]}{R_DELIM}", "label_color")
+        match_display = colorize(data["text"], rule["color"])
+        fragments[key] = f"{label_display} {match_display}"
+
     output_lines = []
-    for line in annotated_content.splitlines():
-        processed_line = line
-        # Replace our placeholders
-        for key, data in matches.items():
-            if f"%%LABEL_{key}%%" in processed_line:
-                rule = rules[data["rule_idx"]]
-                label_display = colorize(f"{L_DELIM}{key}{R_DELIM}", "label_color")
-                match_display = colorize(data["text"], rule["color"])
-                
-                # After our colored match (which contains a reset), we must re-apply the dull color.
-                replacement = f"{label_display} {match_display}{DULL_CODE}"
-                processed_line = processed_line.replace(f"%%LABEL_{key}%%", replacement)
-        
-        # Start each line with the dull code.
-        output_lines.append(f"{DULL_CODE}{processed_line}")
+    for line, spans in annotated_lines:
+        parts = []
+        last_pos = 0
+        for start, end, key, restore in spans:
+            fragment = fragments.get(key)
+            if fragment is None:
+                continue
+            parts.append(line[last_pos:start])
+            parts.append(fragment)
+            parts.append(restore)
+            last_pos = end
+        parts.append(line[last_pos:])
+        output_lines.append("".join(parts))
+
+    if origins is not None:
+        return "".join(
+            f"\033[{row + 1};{col + 1}H{RESET_CODE}{line}"
+            for (row, col), line in zip(origins, output_lines)
+        ) + RESET_CODE
 
     # Join all processed lines and add a final reset at the very end.
-    final_output = "\n".join(output_lines)
-    print(f"{final_output}{RESET_CODE}", end="")
-    sys.stdout.flush()
+    return "\n".join(output_lines) + RESET_CODE
+
+def run_cached(rule, text, pane_path, action_cmd):
+    """
+    Runs a shell command and returns its stripped output, memoized on disk
+    by (rule, text, pane path) for the rule's `cache_ttl` seconds (default
+    ACTION_CACHE_TTL, 0 disables it), so e.g. repeated `gh` lookups for the
+    same commit don't hit the network again.
+    """
+    ttl = rule.get("cache_ttl")
+    if ttl is None:
+        ttl = ACTION_CACHE_TTL
+    cache_key = json.dumps([rule["regex"], text, pane_path])
+    cache = {}
+    if ttl:
+        cache = read_json(ACTION_CACHE_FILE)
+        cached = cache.get(cache_key)
+        if cached and cached["cmd"] == action_cmd and time.time() - cached["time"] < ttl:
+            return cached["output"]
+
+    output = subprocess.check_output(action_cmd, shell=True).decode("utf-8").strip()
+
+    if ttl:
+        now = time.time()
+        cache = {k: v for k, v in cache.items() if now - v["time"] < MAX_ACTION_CACHE_AGE}
+        cache[cache_key] = {"cmd": action_cmd, "output": output, "time": now}
+        write_json(ACTION_CACHE_FILE, cache)
+    return output
+
+def read_label(annotated_lines, matches, rules, origins=None, search=None):
+    """
+    Reads keys until they spell a full label, redrawing with the remaining
+    candidates after each one. Returns the data of the picked match, or
+    None as soon as the typed keys can't lead to any label (e.g. Escape).
+    A `/` first switches to fuzzy_search over `search` instead.
+    """
+    typed = ""
+    while True:
+        typed += get_key()
+        if typed == "/" and search is not None:
+            return fuzzy_search(*search, rules)
+        if typed in matches:
+            return matches[typed]
+        if not any(key.startswith(typed) for key in matches):
+            return None
+        print("\033[H\033[2J" + render_lines(annotated_lines, matches, rules, typed, origins), end="")
+        sys.stdout.flush()
+
+def build_search_index(entries):
+    """
+    Indexes the search entries for narrow_search and narrow_index as one
+    string, with a line per entry: its lowercased text and, after a NUL,
+    its index. Returns (lines, index), lines being the entry lines the
+    index is made of.
+    """
+    lines = [f"\n{text.lower()}\x00{idx}" for idx, (_, _, text, *_) in enumerate(entries)]
+    return lines, "".join(lines)
+
+def fuzzy_pattern(query, substring=False):
+    """
+    Compiles the regex that finds the entries of a search index (see
+    build_search_index) that hold `query` as a subsequence (or, with
+    `substring`, as a substring). The rest of the text is skipped and the
+    entry index captured, so each entry matches at most once.
+    """
+    tag = r"[^\n\x00]*+\x00(\d+)"
+    if substring:
+        return re.compile(re.escape(query) + tag)
+    chars = [re.escape(char) for char in query]
+    # Each character is taken at its first occurrence after the previous one
+    return re.compile(chars[0] + "".join(f"[^\\n\\x00{char}]*+{char}" for char in chars[1:]) + tag)
+
+def narrow_search(lines, index, query, limit):
+    """
+    Finds up to `limit` entries of `index` (see build_search_index) whose
+    text holds the lowercased `query` as a subsequence, those that hold it
+    as a substring first, then in index order. It is a regex scan of
+    `index` that stops after `limit` hits (and a second one for the
+    substrings, only if it did stop), so there is no Python work per
+    entry. Returns the entry indices.
+    """
+    if not query:
+        return list(range(min(limit, len(lines))))
+    fuzzy_hits = [int(match[1]) for match in islice(fuzzy_pattern(query).finditer(index), limit)]
+    if len(fuzzy_hits) < limit:
+        # These are all the entries that match, so look for substrings among them
+        hits = [idx for idx in fuzzy_hits if query in lines[idx].partition("\x00")[0]]
+    else:
+        hits = [int(match[1]) for match in islice(fuzzy_pattern(query, substring=True).finditer(index), limit)]
+    seen = set(hits)
+    hits.extend(idx for idx in fuzzy_hits if idx not in seen)
+    return hits[:limit]
+
+def narrow_index(lines, index, query):
+    """
+    Returns the part of `index` whose entries hold `query` as a
+    subsequence, to search instead of `index` once the query gets longer.
+    """
+    return "".join(map(lines.__getitem__, map(int, fuzzy_pattern(query).findall(index))))
+
+def render_search(entries, context, rules, query, hits, selected, width):
+    """Renders the search prompt and the matching entries, one per row."""
+    rows = [colorize(f"/{query}", "label_color")]
+    for row, idx in enumerate(hits):
+        context_idx, rule_idx, text, *_ = entries[idx]
+        marker = ">" if row == selected else " "
+        context_width = max(0, width - len(text) - 4)
+        line = context[context_idx].strip()[:context_width]
+        rows.append(f"{marker} {colorize(text, rules[rule_idx]['color'])}  {colorize(line, 'dull')}")
+    return "\n".join(rows)
+
+def fuzzy_search(entries, context, rules):
+    """
+    Interactive fuzzy search over every match, labeled or not (see
+    search_entries): typing filters them (fuzzy, case insensitive, exact
+    substrings first), Ctrl-N/Ctrl-P move the selection, Enter picks it
+    and Escape gives up. Returns the picked match's data, or None.
+    """
+    lines, index = build_search_index(entries)
+    # The entries matching each prefix of the query, so Backspace is just a pop
+    indexes = [index]
+    query = ""
+    selected = 0
+    while True:
+        width, height = shutil.get_terminal_size()
+        hits = narrow_search(lines, indexes[-1], query, max(1, height - 1))
+        selected = min(selected, max(0, len(hits) - 1))
+        print("\033[H\033[2J" + render_search(entries, context, rules, query, hits, selected, width), end="")
+        sys.stdout.flush()
+        if len(indexes) == len(query):
+            # Narrow all the way while waiting for the next key, so that
+            # keystroke only scans the entries that still match.
+            indexes.append(narrow_index(lines, indexes[-1], query))
+
+        char = get_key()
+        if char in ("\r", "\n"):
+            return match_data(entries[hits[selected]][1:]) if hits else None
+        if char in ("\x1b", "\x03"):
+            return None
+        if char == "\x0e":  # Ctrl-N
+            selected = min(selected + 1, len(hits) - 1)
+        elif char == "\x10":  # Ctrl-P
+            selected = max(0, selected - 1)
+        elif char in ("\x7f", "\x08"):
+            if query:
+                query = query[:-1]
+                indexes.pop()
+        elif char.isprintable():
+            query += char.lower()
+            selected = 0
+
+def run_action(action_type, action_cmd, rule, text, pane_path):
+    """Performs a rule's action for the selected match."""
+    try:
+        if action_type == "copy":
+            # Restored original command structure for system clipboard copy
+            copy_cmd = f"tmux set-buffer -w -- '{action_cmd}' && tmux save-buffer - | pbcopy"
+            subprocess.run(copy_cmd, shell=True, check=True)
+            subprocess.run(f"tmux display-message -d 1000 'Copied: {action_cmd}'", shell=True)
+        elif action_type == "exec":
+            # The `cd` command is now expected to be part of the action_cmd string itself
+            subprocess.run(action_cmd, shell=True, check=True)
+            subprocess.run(f"tmux display-message -d 1000 'Executed: {action_cmd}'", shell=True)
+        elif action_type == "exco":
+            # The `cd` command is now expected to be part of the action_cmd string itself
+            output = run_cached(rule, text, pane_path, action_cmd)
+            # Restored original command structure for system clipboard copy
+            copy_cmd = f"tmux set-buffer -w -- '{output}' && tmux save-buffer - | pbcopy"
+            subprocess.run(copy_cmd, shell=True, check=True)
+            subprocess.run(f"tmux display-message -d 2000 'Copied: {output}'", shell=True)
+        elif action_type == "type":
+            # Send the text directly to the tmux pane
+            subprocess.run(["tmux", "send-keys", action_cmd], check=True)
+            subprocess.run(f"tmux display-message -d 1000 'Typed: {action_cmd}'", shell=True)
+        elif action_type == "exty":
+            # Execute command, capture output, and send to tmux pane
+            output = run_cached(rule, text, pane_path, action_cmd)
+            subprocess.run(["tmux", "send-keys", output], check=True)
+            subprocess.run(f"tmux display-message -d 2000 'Sent: {output}'", shell=True)
+    except subprocess.CalledProcessError as e:
+         subprocess.run(
+            f"tmux display-message -d 2000 'Action failed: {e}'",
+            shell=True
+        )
+
+
+def dispatch_action(action_type, action_cmd, rule, text, pane_path):
+    """
+    Hands the action over to a detached worker (this script in `action`
+    mode), so the popup closes right after the keypress instead of waiting
+    for slow commands. The worker reports through display-message and the
+    clipboard as usual.
+    """
+    job = json.dumps({
+        "type": action_type,
+        "cmd": action_cmd,
+        "regex": rule["regex"],
+        "cache_ttl": rule.get("cache_ttl"),
+        "text": text,
+        "pane_path": pane_path,
+    })
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "action", job],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+def action_mode(job_json):
+    """Runs an action dispatched by display_mode."""
+    job = json.loads(job_json)
+    rule = {"regex": job["regex"], "cache_ttl": job["cache_ttl"]}
+    with tmux_trace.phase("action"):
+        run_action(job["type"], job["cmd"], rule, job["text"], job["pane_path"])
+
+def display_mode(rules_path, pane_path, fifo_path):
+    """
+    Reads the annotated content and rule specs from the FIFO, renders final
+    output, and handles user interaction.
+    """
+    try:
+        with tmux_trace.phase("handoff"):
+            matches, annotated_lines, rules, origins, search = receive_handoff(fifo_path)
+    except (OSError, ValueError) as e:
+        print(f"Error reading matches: {e}")
+        sys.exit(1)
+
+    with tmux_trace.phase("render"):
+        final_output = render_lines(annotated_lines, matches, rules, origins=origins)
+        print(final_output, end="")
+        sys.stdout.flush()
 
     if matches:
-        key_pressed = get_key()
+        with tmux_trace.phase("input"):
+            data = read_label(annotated_lines, matches, rules, origins, search)
         
-        if key_pressed in matches:
-            data = matches[key_pressed]
-            rule = rules[data["rule_idx"]]
+        if data is not None:
+            pane_path = data.get("pane_path", pane_path)
+            # Only now are the actual actions needed, so rules.py is
+            # executed here rather than before rendering.
+            try:
+                with tmux_trace.phase("rules"):
+                    rule = load_rules_from_path(rules_path)[data["rule_idx"]]
+                if rule["regex"] != rules[data["rule_idx"]]["regex"]:
+                    raise ValueError("rules changed, try again")
+            except Exception as e:
+                subprocess.run(["tmux", "display-message", f"Error loading rules: {e}"])
+                sys.exit(1)
             action = rule["action"]
             
             action_type = None
@@ -202,40 +937,8 @@ def display_mode(rules_path, pane_path, match_filepath, content_filepath):
                 action_type, action_cmd_template = action.split(" ", 1)
                 action_cmd = action_cmd_template.replace("PLACEHOLDER", data["text"])
 
-            try:
-                if action_type == "copy":
-                    # Restored original command structure for system clipboard copy
-                    copy_cmd = f"tmux set-buffer -w -- '{action_cmd}' && tmux save-buffer - | pbcopy"
-                    subprocess.run(copy_cmd, shell=True, check=True)
-                    subprocess.run(f"tmux display-message -d 1000 'Copied: {action_cmd}'", shell=True)
-                elif action_type == "exec":
-                    # The `cd` command is now expected to be part of the action_cmd string itself
-                    subprocess.run(action_cmd, shell=True, check=True)
-                    subprocess.run(f"tmux display-message -d 1000 'Executed: {action_cmd}'", shell=True)
-                elif action_type == "exco":
-                    # The `cd` command is now expected to be part of the action_cmd string itself
-                    output = subprocess.check_output(action_cmd, shell=True).decode("utf-8").strip()
-                    # Restored original command structure for system clipboard copy
-                    copy_cmd = f"tmux set-buffer -w -- '{output}' && tmux save-buffer - | pbcopy"
-                    subprocess.run(copy_cmd, shell=True, check=True)
-                    subprocess.run(f"tmux display-message -d 2000 'Copied: {output}'", shell=True)
-                elif action_type == "type":
-                    # Send the text directly to the tmux pane
-                    subprocess.run(["tmux", "send-keys", action_cmd], check=True)
-                    subprocess.run(f"tmux display-message -d 1000 'Typed: {action_cmd}'", shell=True)
-                elif action_type == "exty":
-                    # Execute command, capture output, and send to tmux pane
-                    output = subprocess.check_output(action_cmd, shell=True).decode("utf-8").strip()
-                    subprocess.run(["tmux", "send-keys", output], check=True)
-                    subprocess.run(f"tmux display-message -d 2000 'Sent: {output}'", shell=True)
-            except subprocess.CalledProcessError as e:
-                 subprocess.run(
-                    f"tmux display-message -d 2000 'Action failed: {e}'",
-                    shell=True
-                )
-
-    os.remove(match_filepath)
-    os.remove(content_filepath)
+            with tmux_trace.phase("action"):
+                dispatch_action(action_type, action_cmd, rule, data["text"], pane_path)
 
 
 if __name__ == "__main__":
@@ -244,23 +947,34 @@ if __name__ == "__main__":
         sys.exit(1)
 
     mode = sys.argv[1]
+    tmux_trace.start(f"tmux-uhm {mode}", _IMPORT_START)
 
     if mode == "parse":
-        if len(sys.argv) != 4:
-            print("Usage: python tmux-uhm.py parse <rules_path> <pane_path>")
+        if len(sys.argv) not in (4, 5):
+            print("Usage: python tmux-uhm.py parse <rules_path> <pane_path> [history_lines]")
             sys.exit(1)
         rules_path_arg = sys.argv[2]
         pane_path_arg = sys.argv[3]
-        parse_mode(rules_path_arg, pane_path_arg)
+        history_arg = int(sys.argv[4]) if len(sys.argv) == 5 else None
+        parse_mode(rules_path_arg, pane_path_arg, history_arg)
+    elif mode == "window":
+        if len(sys.argv) != 4:
+            print("Usage: python tmux-uhm.py window <rules_path> <pane_path>")
+            sys.exit(1)
+        window_mode(sys.argv[2], sys.argv[3])
     elif mode == "display":
-        if len(sys.argv) != 6:
-            print("Usage: python tmux-uhm.py display <rules_path> <pane_path> <match_file> <content_file>")
+        if len(sys.argv) != 5:
+            print("Usage: python tmux-uhm.py display <rules_path> <pane_path> <fifo_path>")
             sys.exit(1)
         rules_path_arg = sys.argv[2]
         pane_path_arg = sys.argv[3]
-        match_filepath_arg = sys.argv[4]
-        content_filepath_arg = sys.argv[5]
-        display_mode(rules_path_arg, pane_path_arg, match_filepath_arg, content_filepath_arg)
+        fifo_path_arg = sys.argv[4]
+        display_mode(rules_path_arg, pane_path_arg, fifo_path_arg)
+    elif mode == "action":
+        if len(sys.argv) != 3:
+            print("Usage: python tmux-uhm.py action <job_json>")
+            sys.exit(1)
+        action_mode(sys.argv[2])
     else:
         print(f"Unknown mode: {mode}")
         sys.exit(1)